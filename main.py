@@ -32,90 +32,122 @@ except ImportError as e:
     types = None
     ProviderGoogleGenAI = None  # 若 SDK 無法使用，則不進行修補
 
-# 儲存原始方法
-_original_prepare_query_config = None
-_original_process_content_parts = None
-
 # --- 修補方法 (低耦合包裝模式) ---
+#
+# 修補函式由工廠建立，原始方法在套用補丁時以預設參數綁定，
+# 每層補丁各自持有其原始方法，而不依賴模組層級的全域變數。
+
+
+def _make_prepare_query_config_patch(original):
+    async def _patched_prepare_query_config(
+        self: ProviderGoogleGenAI, *args, _orig=original, _types=types, **kwargs
+    ) -> types.GenerateContentConfig:
+        """
+        採用包裝器方法的 `_prepare_query_config` 修補版本。
+        它會呼叫原始方法，然後注入 `thinking_config`。
+        此作法不依賴原始方法的實作，因而降低了耦合度。
+        """
+        # 呼叫原始方法以取得基礎設定
+        original_config = await _orig(self, *args, **kwargs)
+
+        # 注入我們的 thinking_config
+        if self.provider_config.get("gm_include_thoughts", True):
+            logger.debug("GeminiPatcher: Injecting thinking_config.")
+            try:
+                original_config.thinking_config = _types.ThinkingConfig(
+                    include_thoughts=True,
+                    thinking_budget=self.provider_config.get(
+                        "gm_thinking_budget", 2048
+                    ),
+                )
+            except TypeError:
+                # Fallback for SDKs that don't support include_thoughts param
+                original_config.thinking_config = _types.ThinkingConfig(
+                    thinking_budget=self.provider_config.get(
+                        "gm_thinking_budget", 2048
+                    ),
+                )
 
-
-async def _patched_prepare_query_config(
-    self: ProviderGoogleGenAI, *args, **kwargs
-) -> types.GenerateContentConfig:
-    """
-    採用包裝器方法的 `_prepare_query_config` 修補版本。
-    它會呼叫原始方法，然後注入 `thinking_config`。
-    此作法不依賴原始方法的實作，因而降低了耦合度。
-    """
-    # 呼叫原始方法以取得基礎設定
-    original_config = await _original_prepare_query_config(self, *args, **kwargs)
-
-    # 注入我們的 thinking_config
-    if self.provider_config.get("gm_include_thoughts", True):
-        logger.debug("GeminiPatcher: Injecting thinking_config.")
-        try:
-            original_config.thinking_config = types.ThinkingConfig(
-                include_thoughts=True,
-                thinking_budget=self.provider_config.get("gm_thinking_budget", 2048),
-            )
-        except TypeError:
-            # Fallback for SDKs that don't support include_thoughts param
-            original_config.thinking_config = types.ThinkingConfig(
-                thinking_budget=self.provider_config.get("gm_thinking_budget", 2048),
-            )
-
-    return original_config
-
-
-def _patched_process_content_parts(
-    candidate: types.Candidate, llm_response: LLMResponse
-) -> MessageChain:
+        return original_config
+
+    _patched_prepare_query_config._is_gemini_patcher = True
+    _patched_prepare_query_config._gemini_patcher_original = original
+    return _patched_prepare_query_config
+
+
+def _make_process_content_parts_patch(original):
+    def _patched_process_content_parts(
+        candidate: types.Candidate, llm_response: LLMResponse, *, _orig=original
+    ) -> MessageChain:
+        """
+        採用包裝器方法的 `_process_content_parts` 修補版本。
+        它會攔截回應 Candidate，提取思考歷程部分 (thought parts)，將其附加到 LLMResponse 物件，然後將清理後的回應傳遞給原始方法。
+        這將插件與處理內容部分 (parts) 的核心邏輯解耦。
+        """
+        thinking_text = []
+        final_parts = []
+
+        # 安全地存取並過濾內容，將思考歷程與最終內容分離
+        content = getattr(candidate, "content", None) if candidate else None
+        parts = getattr(content, "parts", None) if content else None
+        if not content:
+            # 若回應格式有誤，則不做任何處理，並讓原始方法應對
+            logger.debug("GeminiPatcher: Candidate has no content, skipping.")
+        # 快速路徑：沒有任何思考部分時（常見情況），無需重建 parts
+        elif parts and any(getattr(p, "thought", False) for p in parts):
+            # 每次呼叫只檢查一次日誌等級，避免在每個 part 上格式化字串
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            for part in parts:
+                # 盡可能兼容不同 SDK 版本的思考標記
+                is_thought = bool(getattr(part, "thought", False))
+                if is_thought and getattr(part, "text", None):
+                    if debug_enabled:
+                        logger.debug(
+                            "GeminiPatcher: Captured a thought part: '%s...'",
+                            part.text[:100],
+                        )
+                    thinking_text.append(part.text)
+                else:
+                    final_parts.append(part)
+
+            # 就地修改結果物件，使其僅包含非思考歷程的部分
+            content.parts[:] = final_parts
+
+        # 將擷取到的思考歷程內容附加到回應物件
+        if thinking_text:
+            reasoning_content = "\n\n".join(thinking_text)
+            logger.debug("GeminiPatcher: Attaching reasoning_content to LLMResponse.")
+            setattr(llm_response, "reasoning_content", reasoning_content)
+
+        # 呼叫原始方法並傳入清理後的結果，讓它處理所有實際的程序
+        return _orig(candidate, llm_response)
+
+    _patched_process_content_parts._is_gemini_patcher = True
+    _patched_process_content_parts._gemini_patcher_original = original
+    return _patched_process_content_parts
+
+
+def _resolve_original(name: str, method):
     """
-    採用包裝器方法的 `_process_content_parts` 修補版本。
-    它會攔截回應 Candidate，提取思考歷程部分 (thought parts)，將其附加到 LLMResponse 物件，然後將清理後的回應傳遞給原始方法。
-    這將插件與處理內容部分 (parts) 的核心邏輯解耦。
+    若 `method` 是先前套用的補丁（例如插件未經 terminate 便被重載），
+    則回傳它所包裝的真正原始方法；否則原樣回傳。
     """
-    thinking_text = []
-    final_parts = []
-
-    # 安全地存取並過濾內容，將思考歷程與最終內容分離
-    try:
-        if not candidate or not getattr(candidate, "content", None):
-            raise AttributeError("Candidate has no content.")
-        original_parts = candidate.content.parts or []
-        for part in original_parts:
-            # 盡可能兼容不同 SDK 版本的思考標記
-            is_thought = bool(getattr(part, "thought", False))
-            if is_thought and getattr(part, "text", None):
-                logger.debug(
-                    f"GeminiPatcher: Captured a thought part: '{part.text[:100]}...'"
-                )
-                thinking_text.append(part.text)
-            else:
-                final_parts.append(part)
-
-        # 就地修改結果物件，使其僅包含非思考歷程的部分
-        candidate.content.parts[:] = final_parts
-
-    except (IndexError, AttributeError):
-        # 若回應格式有誤，則不做任何處理，並讓原始方法應對
-        pass
-
-    # 將擷取到的思考歷程內容附加到回應物件
-    if thinking_text:
-        reasoning_content = "\n\n".join(thinking_text)
-        logger.debug("GeminiPatcher: Attaching reasoning_content to LLMResponse.")
-        setattr(llm_response, "reasoning_content", reasoning_content)
+    if not getattr(method, "_is_gemini_patcher", False):
+        return method
+    logger.warning(
+        f"GeminiPatcherPlugin: {name} is already patched, replacing the existing patch."
+    )
+    return method._gemini_patcher_original
 
-    # 呼叫原始方法並傳入清理後的結果，讓它處理所有實際的程序
-    return _original_process_content_parts.__func__(candidate, llm_response)
 
 class GeminiPatcher(Star):
 
     def __init__(self, context: Context, config: dict | None = None):
         super().__init__(context)
         self.config = config or {}
-        global _original_prepare_query_config, _original_process_content_parts
+        # 儲存原始方法，供 terminate 時恢復
+        self._original_prepare_query_config = None
+        self._original_process_content_parts = None
 
         if ProviderGoogleGenAI is None:
             logger.error(
@@ -125,30 +157,49 @@ class GeminiPatcher(Star):
 
         logger.info("GeminiPatcherPlugin: Initializing and applying patches...")
 
-        _original_prepare_query_config = ProviderGoogleGenAI._prepare_query_config
-        _original_process_content_parts = ProviderGoogleGenAI.__dict__[
-            "_process_content_parts"
-        ]
+        # 透過 __dict__ 取得 staticmethod 物件，並在此一次性解包為普通函式
+        _sm = ProviderGoogleGenAI.__dict__.get("_process_content_parts")
+        if not isinstance(_sm, staticmethod):
+            # terminate 會以 staticmethod 恢復原始方法，其他型別無法安全地還原
+            logger.error(
+                "GeminiPatcherPlugin: Cannot apply patches because _process_content_parts is not a staticmethod."
+            )
+            return
 
-        ProviderGoogleGenAI._prepare_query_config = _patched_prepare_query_config
+        # 若未經 terminate 便重載插件，類上的方法可能仍是舊模組的補丁版本；
+        # 取回其包裝的真正原始方法，再套用新補丁，使重載後的程式碼生效且不疊加補丁。
+        original_prepare_query_config = _resolve_original(
+            "_prepare_query_config", ProviderGoogleGenAI._prepare_query_config
+        )
+        original_process_content_parts = _resolve_original(
+            "_process_content_parts", _sm.__func__
+        )
+
+        ProviderGoogleGenAI._prepare_query_config = _make_prepare_query_config_patch(
+            original_prepare_query_config
+        )
         ProviderGoogleGenAI._process_content_parts = staticmethod(
-            _patched_process_content_parts
+            _make_process_content_parts_patch(original_process_content_parts)
         )
+        self._original_prepare_query_config = original_prepare_query_config
+        self._original_process_content_parts = original_process_content_parts
 
         logger.info(
             "GeminiPatcherPlugin: Patches for _prepare_query_config and _process_content_parts applied successfully."
         )
 
     async def terminate(self):
-        global _original_prepare_query_config, _original_process_content_parts
-
-        if ProviderGoogleGenAI is None or _original_prepare_query_config is None:
+        if ProviderGoogleGenAI is None or self._original_prepare_query_config is None:
             logger.info("GeminiPatcherPlugin: No patches to remove.")
             return
 
         logger.info("GeminiPatcherPlugin: Terminating and removing patches...")
 
-        ProviderGoogleGenAI._prepare_query_config = _original_prepare_query_config
-        ProviderGoogleGenAI._process_content_parts = _original_process_content_parts
+        ProviderGoogleGenAI._prepare_query_config = self._original_prepare_query_config
+        ProviderGoogleGenAI._process_content_parts = staticmethod(
+            self._original_process_content_parts
+        )
+        self._original_prepare_query_config = None
+        self._original_process_content_parts = None
 
         logger.info("GeminiPatcherPlugin: Patches removed successfully.")